@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, has_request_context
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
@@ -6,6 +6,16 @@ import sqlite3
 import os
 from functools import wraps
 from flask_wtf.csrf import CSRFProtect
+from werkzeug.middleware.proxy_fix import ProxyFix
+from jinja2 import FileSystemBytecodeCache, FileSystemLoader
+import click
+import time
+from tenancy import ShardRouter, teacher_tenant
+from backup import Snapshot, backup_all, jobs as backup_jobs
+import compression
+import ratelimit
+import sync
+import queries
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-here')
@@ -16,15 +26,75 @@ app.config['WTF_CSRF_ENABLED'] = True  # Включаем CSRF защиту
 # Инициализация CSRF защиты
 csrf = CSRFProtect(app)
 
+# Скомпилированные шаблоны хранятся на диске и общие для всех воркеров;
+# кеш прогревается при деплое командой `flask warm-templates`
+app.config['JINJA_CACHE_DIR'] = os.environ.get(
+    'SCHOOL_JINJA_CACHE_DIR',
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), ".jinja_cache"))
+os.makedirs(app.config['JINJA_CACHE_DIR'], exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_CACHE_DIR'])
+
+# Сжатие ответов и компактный JSON
+app.json.compact = True
+compression.init_compression(app)
+
+# За обратным прокси адрес клиента берётся из X-Forwarded-For; число прокси
+# задаётся явно, чтобы клиент не мог подставить чужой адрес
+app.config['PROXY_HOPS'] = int(os.environ.get('SCHOOL_PROXY_HOPS', 1))
+if app.config['PROXY_HOPS']:
+    app.wsgi_app = ProxyFix(app.wsgi_app,
+                            x_for=app.config['PROXY_HOPS'],
+                            x_proto=app.config['PROXY_HOPS'])
+
+# Ограничения частоты: общий файл SQLite делает лимиты едиными для всех воркеров.
+# Если хранилище занято, вход отклоняется (перебор не должен проходить под
+# нагрузкой), а поиск пропускается
+rate_store = ratelimit.make_store(os.environ.get('SCHOOL_RATELIMIT_DB'))
+login_ip_limit = ratelimit.RateLimiter('login_ip', rate_store, per_minute=10, capacity=10,
+                                       fail_open=False)
+login_user_limit = ratelimit.RateLimiter('login_user', rate_store, per_minute=5, capacity=5,
+                                         fail_open=False)
+search_ip_limit = ratelimit.RateLimiter('search_ip', rate_store, per_minute=60, capacity=20)
+search_user_limit = ratelimit.RateLimiter('search_user', rate_store, per_minute=30, capacity=10)
+
 # Конфигурация базы данных
 DB_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), "school.db")
 
+# Мультитенантный режим: если задан каталог шардов, у каждой школы своя база
+app.config['SHARDS_DIR'] = os.environ.get('SCHOOL_SHARDS_DIR')
+router = ShardRouter(DB_PATH, app.config['SHARDS_DIR'])
+
+
+# Резервные копии и снимки только для чтения для тяжёлых отчётов
+app.config['BACKUP_DIR'] = os.environ.get(
+    'SCHOOL_BACKUP_DIR', os.path.join(os.path.dirname(DB_PATH), "backups"))
+app.config['SNAPSHOT_MAX_AGE'] = int(os.environ.get('SCHOOL_SNAPSHOT_MAX_AGE', 300))
+
+
+def get_directory_db():
+    """Соединение с общей базой пользователей"""
+    return router.directory()
+
+
+def request_tenant():
+    """Школа из параметра ``tenant``, если в ней есть дети текущего родителя"""
+    tenant = request.args.get('tenant')
+    if tenant and tenant in session.get('tenants', []):
+        return tenant
+    return None
 
-def get_db():
-    """Устанавливает соединение с базой данных"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+
+def get_db(tenant=None):
+    """Устанавливает соединение с базой данных школы текущего пользователя.
+
+    Учитель всегда работает в своей школе; родитель выбирает одну из школ
+    своих детей параметром ``tenant`` в адресе.
+    """
+    if router.enabled and has_request_context():
+        tenant = tenant or session.get('tenant') or request_tenant()
+        if tenant:
+            return router.connect(tenant)
+    return get_directory_db()
 
 
 def init_db():
@@ -91,26 +161,43 @@ def init_db():
             print("Таблицы успешно созданы")
         else:
             print("Таблицы уже существуют")
+        sync.ensure_sync_schema(conn)
+
+        # Кубки из старого приложения templates/main.py переносим в monthly_awards
+        moved = queries.migrate_trophies(conn)
+        if moved:
+            print(f"Перенесено кубков из monthly_trophies: {moved}")
     except sqlite3.Error as e:
         print(f"Ошибка при инициализации базы данных: {e}")
         raise
     finally:
         conn.close()
 
+    if router.enabled:
+        router.init_directory()
+        # Шарды, созданные до появления синхронизации, получают новые колонки
+        for tenant in router.tenants():
+            router.ensure_shard(tenant)
+
+def all_db_paths():
+    """Пути ко всем файлам баз: справочник и шарды школ"""
+    return [DB_PATH] + [router.shard_path(tenant) for tenant in router.tenants()]
+
+
+def get_snapshot(src_path):
+    """Снимок базы только для чтения, на который переводятся тяжёлые отчёты"""
+    snapshot_path = os.path.join(app.config['BACKUP_DIR'], "snapshots", os.path.basename(src_path))
+    return Snapshot(src_path, snapshot_path, app.config['SNAPSHOT_MAX_AGE'])
+
 # Создание первого учителя
 def create_first_teacher():
     """Создает учетную запись администратора по умолчанию"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
+        conn = get_directory_db()
 
-        cursor.execute("SELECT * FROM users WHERE is_teacher = 1")
-        if not cursor.fetchone():
+        if not queries.has_teacher(conn):
             hashed_password = generate_password_hash("admin123")
-            cursor.execute(
-                "INSERT INTO users (username, password, role, is_teacher) VALUES (?, ?, ?, ?)",
-                ("admin", hashed_password, "admin", 1)
-            )
+            queries.create_user(conn, "admin", hashed_password, "admin", True)
             conn.commit()
             print("Создан учитель по умолчанию: admin/admin123")
     except sqlite3.Error as e:
@@ -142,6 +229,42 @@ def teacher_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not session.get('is_admin'):
+            flash('Эта функция доступна только администратору', 'error')
+            return redirect(url_for('home'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+# Подготовка данных для шаблонов: шаблоны только подставляют готовые значения
+COIN = '🪙'
+AWARD_ICONS = {1: '🏆', 2: '🥈', 3: '🥉', 4: '❌'}
+
+
+def lesson_display(lesson):
+    """Дополняет кортеж урока: (..., монеты за домашку, строки монет по трём колонкам)"""
+    homework = int(lesson[6]) if lesson[6].isdigit() else 0
+    return lesson + (homework, COIN * lesson[4], COIN * lesson[5], COIN * homework)
+
+
+def month_cards(year, month, awards, current_date):
+    """Карточки шести месяцев вокруг выбранного с наградами"""
+    cards = []
+    for i in range(-3, 3):
+        date = datetime(year, month, 1) + relativedelta(months=i)
+        award = awards.get((date.year, date.month))
+        cards.append({
+            'year': date.year,
+            'month': date.month,
+            'name': date.strftime('%B'),
+            'is_current': (date.year == current_date.year and date.month == current_date.month),
+            'award': award,
+            'icon': AWARD_ICONS.get(award, '')
+        })
+    return cards
+
 # Маршруты аутентификации
 @app.route('/')
 def index():
@@ -155,20 +278,35 @@ def login():
         username = request.form.get('username', '').strip()
         password = request.form.get('password', '').strip()
 
+        # Отсекаем перебор паролей до дорогой проверки хеша
+        if not (login_ip_limit.allow(request.remote_addr)
+                and login_user_limit.allow(username.lower())):
+            flash('Слишком много попыток входа. Попробуйте позже', 'error')
+            return render_template('login.html'), 429
+
         try:
-            with get_db() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    'SELECT id, username, password, is_teacher, role FROM users WHERE username = ?',
-                    (username,)
-                )
-                user = cursor.fetchone()
-
-            if user and check_password_hash(user['password'], password):
-                session['user_id'] = user['id']
-                session['username'] = user['username']
-                session['is_teacher'] = bool(user['is_teacher'])
-                session['is_parent'] = user['role'] == 'parent'
+            conn = get_directory_db()
+            try:
+                user = queries.user_by_username(conn, username)
+            finally:
+                conn.close()
+
+            if user and check_password_hash(user[2], password):
+                user_id, username, _, is_teacher, role = user
+                session['user_id'] = user_id
+                session['username'] = username
+                session['is_teacher'] = bool(is_teacher)
+                session['is_parent'] = role == 'parent'
+                session['is_admin'] = role == 'admin'
+                if router.enabled and role == 'parent':
+                    session['tenants'] = router.parent_tenants(user_id)
+                elif router.enabled:
+                    tenant = router.tenant_for_user(user_id)
+                    if tenant is None and is_teacher:
+                        # Учитель, заведённый до включения шардов, получает свою базу
+                        tenant = teacher_tenant(user_id)
+                        router.assign_tenant(user_id, tenant)
+                    session['tenant'] = tenant
                 flash('Вы успешно вошли в систему', 'success')
                 return redirect(url_for('home'))
 
@@ -206,13 +344,16 @@ def register():
                 return render_template('register.html', username=username)
 
             hashed_password = generate_password_hash(password)
-            with get_db() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    'INSERT INTO users (username, password, role, is_teacher) VALUES (?, ?, ?, ?)',
-                    (username, hashed_password, role, 1 if role == 'teacher' else 0)
-                )
+            conn = get_directory_db()
+            try:
+                user_id = queries.create_user(conn, username, hashed_password, role, role == 'teacher')
                 conn.commit()
+            finally:
+                conn.close()
+
+            # Каждый новый учитель получает собственную базу
+            if router.enabled and role == 'teacher':
+                router.assign_tenant(user_id, teacher_tenant(user_id))
 
             flash('Регистрация успешна! Теперь войдите', 'success')
             return redirect(url_for('login'))
@@ -235,32 +376,36 @@ def find_student():
     search_name = request.form.get('student_name', '').strip()
     students = []
 
+    if search_name and not (search_ip_limit.allow(request.remote_addr)
+                            and search_user_limit.allow(session['user_id'])):
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return jsonify({'error': 'Слишком много запросов'}), 429
+        flash('Слишком много запросов. Попробуйте позже', 'error')
+        return render_template('find_student.html', students=[], search_name=search_name), 429
+
     try:
         if search_name:
-            conn = get_db()
-            cursor = conn.cursor()
-
             # Ищем по имени или фамилии (если введены оба слова)
             search_terms = search_name.split()
-            query = """
-                SELECT s.id, s.name, s.level, s.start_date, s.goal, 
-                       u.username as teacher_name 
-                FROM students s
-                LEFT JOIN users u ON s.teacher_id = u.id
-                WHERE {}
-                ORDER BY s.name
-            """.format(
-                " AND ".join(["s.name LIKE ?" for _ in search_terms])
-            )
-
-            params = [f'%{term}%' for term in search_terms]
-            cursor.execute(query, params)
-            students = cursor.fetchall()
+            if router.enabled:
+                # Дети родителя могут учиться у любого учителя — ищем во всех шардах,
+                # подключая их пачками к одному соединению
+                sql, params = queries.search_students_sql(search_terms)
+                students = sorted(
+                    (tuple(row[1:]) + (row[0],)
+                     for row in router.cross_shard_query(sql, params, with_directory=True)),
+                    key=lambda row: row[1])
+            else:
+                conn = get_db()
+                try:
+                    students = queries.search_students(conn, search_terms)
+                finally:
+                    conn.close()
 
             # Логирование для отладки
             app.logger.debug(f"Search for '{search_name}' returned {len(students)} results")
             if students:
-                app.logger.debug(f"Found students: {[s['name'] for s in students]}")
+                app.logger.debug(f"Found students: {[s[1] for s in students]}")
 
     except Exception as e:
         app.logger.error(f"Search error: {str(e)}")
@@ -287,22 +432,26 @@ def link_student(student_id):
     if not session.get('is_parent'):
         return redirect(url_for('home'))
 
+    # Ученик выбран из результатов поиска по всем шардам
+    tenant = request.args.get('tenant')
+    if router.enabled and tenant not in router.tenants():
+        flash('Ученик не найден', 'error')
+        return redirect(url_for('find_student'))
+
     try:
-        conn = get_db()
-        cursor = conn.cursor()
+        conn = get_db(tenant)
 
         # Проверяем, что студент существует
-        cursor.execute("SELECT id FROM students WHERE id = ?", (student_id,))
-        if not cursor.fetchone():
+        if not queries.student_brief(conn, student_id):
             flash('Ученик не найден', 'error')
             return redirect(url_for('find_student'))
 
         # Связываем родителя с учеником
-        cursor.execute(
-            "INSERT OR IGNORE INTO parents (user_id, student_id) VALUES (?, ?)",
-            (session['user_id'], student_id)
-        )
+        queries.link_parent(conn, session['user_id'], student_id)
         conn.commit()
+        if router.enabled:
+            router.add_parent_tenant(session['user_id'], tenant)
+            session['tenants'] = sorted(set(session.get('tenants', [])) | {tenant})
         flash('Ученик успешно привязан к вашему аккаунту', 'success')
 
     except Exception as e:
@@ -321,19 +470,14 @@ def parent_dashboard():
     if not session.get('is_parent'):
         return redirect(url_for('home'))
 
-    conn = get_db()
-    cursor = conn.cursor()
-
-    # Получаем всех привязанных учеников
-    cursor.execute("""
-        SELECT s.id, s.name, s.level 
-        FROM students s
-        JOIN parents p ON s.id = p.student_id
-        WHERE p.user_id = ?
-    """, (session['user_id'],))
-    students = cursor.fetchall()
-
-    conn.close()
+    # Получаем всех привязанных учеников из всех школ родителя
+    students = []
+    for tenant in (router.parent_tenants(session['user_id']) if router.enabled else [None]):
+        conn = get_db(tenant)
+        try:
+            students.extend(queries.parent_students(conn, session['user_id'], tenant))
+        finally:
+            conn.close()
 
     return render_template('parent_dashboard.html', students=students)
 
@@ -357,16 +501,13 @@ def home():
     if session.get('is_parent'):
         return redirect(url_for('parent_dashboard'))
 
-    conn = sqlite3.connect("school.db")
-    cursor = conn.cursor()
-
+    students = []
     if session.get('is_teacher'):
-        cursor.execute("SELECT * FROM students WHERE teacher_id = ?", (session['user_id'],))
-    else:
-        cursor.execute("SELECT * FROM students LIMIT 0")
-
-    students = cursor.fetchall()
-    conn.close()
+        conn = get_db()
+        try:
+            students = queries.teacher_students(conn, session['user_id'])
+        finally:
+            conn.close()
     return render_template("index.html", students=students)
 
 @app.route("/student/<int:student_id>")
@@ -374,78 +515,39 @@ def home():
 def student(student_id):
     """Страница ученика с его данными и прогрессом"""
     conn = get_db()
-    cursor = conn.cursor()
 
     try:
         # Проверяем права доступа
         if session.get('is_teacher'):
             # Учитель видит только своих учеников
-            cursor.execute("""
-                SELECT s.*, u.username as teacher_name 
-                FROM students s
-                LEFT JOIN users u ON s.teacher_id = u.id
-                WHERE s.id = ? AND s.teacher_id = ?
-            """, (student_id, session['user_id']))
+            student = queries.student_for_teacher(conn, student_id, session['user_id'])
         elif session.get('is_parent'):
             # Родитель видит только привязанных учеников
-            cursor.execute("""
-                SELECT s.*, u.username as teacher_name 
-                FROM students s
-                LEFT JOIN users u ON s.teacher_id = u.id
-                JOIN parents p ON s.id = p.student_id
-                WHERE s.id = ? AND p.user_id = ?
-            """, (student_id, session['user_id']))
+            student = queries.student_for_parent(conn, student_id, session['user_id'])
         else:
             # Другие пользователи не имеют доступа
-            cursor.execute("SELECT * FROM students WHERE id = ? LIMIT 0", (student_id,))
-
-        student = cursor.fetchone()
+            student = None
 
         if not student:
             flash("Ученик не найден или у вас нет прав доступа", "error")
             return redirect(url_for("home"))
 
         # Для учителей создаем недостающие уроки (первые 8)
-        if session.get('is_teacher'):
-            cursor.execute("SELECT COUNT(*) FROM lessons WHERE student_id = ?", (student_id,))
-            lesson_count = cursor.fetchone()[0]
-
-            if lesson_count < 8:
-                for i in range(lesson_count + 1, 9):
-                    cursor.execute(
-                        "INSERT INTO lessons (student_id, date, topic) VALUES (?, ?, ?)",
-                        (student_id, datetime.now().strftime("%Y-%m-%d"), f"Урок {i}")
-                    )
-                conn.commit()
+        if session.get('is_teacher') and queries.ensure_lessons(conn, student_id):
+            conn.commit()
 
         # Получаем уроки
-        cursor.execute("""
-            SELECT id, student_id, date, topic, 
-                   COALESCE(understanding, 0) as understanding,
-                   COALESCE(participation, 0) as participation,
-                   COALESCE(NULLIF(homework, ''), '0') as homework
-            FROM lessons 
-            WHERE student_id = ? 
-            ORDER BY id ASC
-            LIMIT 8
-        """, (student_id,))
-        lessons = cursor.fetchall()
+        lessons = [lesson_display(lesson) for lesson in queries.student_lessons(conn, student_id)]
+        sync_token = sync.current_token(conn.cursor(), student_id)
 
         # Получаем награды по месяцам
-        cursor.execute("""
-            SELECT year, month, award 
-            FROM monthly_awards 
-            WHERE student_id = ?
-        """, (student_id,))
-        awards = {(year, month): award for year, month, award in cursor.fetchall()}
+        awards = queries.student_awards(conn, student_id)
 
         # Получаем общее количество монет для прогресса
-        total_coins = 0
-        for lesson in lessons:
-            total_coins += lesson['understanding'] + lesson['participation'] + (int(lesson['homework']) if lesson['homework'].isdigit() else 0)
+        total_coins = sum(lesson[4] + lesson[5] + lesson[8] for lesson in lessons)
 
         # Проверяем, является ли текущий пользователь учителем этого ученика
-        is_current_teacher = session.get('is_teacher') and student['teacher_id'] == session['user_id']
+        is_current_teacher = session.get('is_teacher') and student[5] == session['user_id']
 
     except Exception as e:
         flash("Произошла ошибка при загрузке данных ученика", "error")
@@ -454,14 +556,15 @@ def student(student_id):
     finally:
         conn.close()
 
+    current_date = datetime.now()
     return render_template("student.html",
                          student=student,
                          lessons=lessons,
-                         awards=awards,
+                         month_cards=month_cards(current_date.year, current_date.month,
+                                                 awards, current_date),
                          total_coins=total_coins,
-                         is_current_teacher=is_current_teacher,
-                         current_date=datetime.now(),
-                         relativedelta=relativedelta)
+                         sync_token=sync_token,
+                         is_current_teacher=is_current_teacher)
 
 @app.route("/add_student", methods=["POST"])
 @login_required
@@ -483,16 +586,13 @@ def add_student():
             flash(error, "error")
         return redirect(url_for("home"))
 
-    conn = sqlite3.connect("school.db")
-    cursor = conn.cursor()
+    conn = get_db()
     try:
-        cursor.execute(
-            "INSERT INTO students (name, level, start_date, goal, teacher_id) VALUES (?, ?, ?, ?, ?)",
-            (name, level if level else None,
-             start_date if start_date else None,
-             goal if goal else None,
-             session['user_id'])
-        )
+        queries.add_student(conn, name,
+                            level if level else None,
+                            start_date if start_date else None,
+                            goal if goal else None,
+                            session['user_id'])
         conn.commit()
         flash("Ученик добавлен!", "success")
     except sqlite3.IntegrityError:
@@ -516,48 +616,16 @@ def set_coins(lesson_id, coin_type):
         cursor = conn.cursor()
 
         # Проверяем права доступа (учитель этого ученика)
-        cursor.execute("""
-            SELECT 1 FROM lessons l
-            JOIN students s ON l.student_id = s.id
-            WHERE l.id = ? AND s.teacher_id = ?
-        """, (lesson_id, session['user_id']))
-
-        if not cursor.fetchone():
+        if not queries.teacher_owns_lesson(conn, lesson_id, session['user_id']):
             return jsonify({'error': 'Доступ запрещён'}), 403
 
         # Обновляем данные
-        if coin_type == 'homework':
-            cursor.execute("""
-                UPDATE lessons SET homework = ?
-                WHERE id = ?
-            """, (str(coins), lesson_id))
-        else:
-            cursor.execute(f"""
-                UPDATE lessons SET {coin_type} = ?
-                WHERE id = ?
-            """, (coins, lesson_id))
-
+        sync.write_lesson_field(cursor, lesson_id, coin_type,
+                                str(coins) if coin_type == 'homework' else coins)
         conn.commit()
 
-        # Получаем обновлённые данные для ответа
-        cursor.execute("""
-            SELECT COALESCE(understanding, 0) as understanding,
-                   COALESCE(participation, 0) as participation,
-                   COALESCE(NULLIF(homework, ''), '0') as homework
-            FROM lessons WHERE id = ?
-        """, (lesson_id,))
-        lesson = cursor.fetchone()
-
-        total_coins = (lesson['understanding'] +
-                       lesson['participation'] +
-                       int(lesson['homework']))
-
-        return jsonify({
-            'success': True,
-            'coins': coins,
-            'total_coins': total_coins,
-            'updated_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        })
+        # Итоги клиент пересчитывает сам, поэтому возвращаем только статус
+        return jsonify({'success': True})
 
     except Exception as e:
         conn.rollback()
@@ -566,18 +634,48 @@ def set_coins(lesson_id, coin_type):
         conn.close()
 
 
+@app.route("/sync/<int:student_id>", methods=["POST"])
+@login_required
+@teacher_required
+def sync_lessons(student_id):
+    """Принимает пакет офлайн-правок и возвращает изменения после токена клиента"""
+    payload = request.get_json(silent=True) or {}
+    edits = payload.get('edits', [])
+    try:
+        since = int(payload.get('since', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Некорректный токен'}), 400
+    if not isinstance(edits, list):
+        return jsonify({'error': 'Некорректный пакет'}), 400
+
+    conn = get_db()
+    if not queries.student_for_teacher(conn, student_id, session['user_id']):
+        conn.close()
+        return jsonify({'error': 'Доступ запрещён'}), 403
+    try:
+        applied, conflicts, token, changes = sync.apply_batch(
+            conn, session['user_id'], student_id, edits, since)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Некорректный пакет'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+    return jsonify({'applied': applied, 'conflicts': conflicts,
+                    'token': token, 'changes': changes})
+
+
 @app.route("/update_homework/<int:lesson_id>", methods=["POST"])
 @login_required
 def update_homework(lesson_id):
     homework = request.form.get("homework", "")
     student_id = request.form.get("student_id")
 
-    conn = sqlite3.connect("school.db")
+    conn = get_db()
     cursor = conn.cursor()
     try:
-        cursor.execute(
-            "UPDATE lessons SET homework = ? WHERE id = ?",
-            (homework, lesson_id))
+        sync.write_lesson_field(cursor, lesson_id, 'homework', homework)
         conn.commit()
         return jsonify({'status': 'success'})
     except Exception as e:
@@ -593,25 +691,14 @@ def student_awards(student_id):
     selected_month = request.args.get('month', current_date.month, type=int)
     selected_year = request.args.get('year', current_date.year, type=int)
 
-    conn = sqlite3.connect("school.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM students WHERE id = ?", (student_id,))
-    student = cursor.fetchone()
-
-    cursor.execute("SELECT year, month, award FROM monthly_awards WHERE student_id = ?", (student_id,))
-    awards = {(year, month): award for year, month, award in cursor.fetchall()}
-    conn.close()
+    conn = get_db()
+    try:
+        student = queries.student_brief(conn, student_id)
+        awards = queries.student_awards(conn, student_id)
+    finally:
+        conn.close()
 
-    months = []
-    for i in range(-3, 3):
-        date = datetime(selected_year, selected_month, 1) + relativedelta(months=i)
-        months.append({
-            'year': date.year,
-            'month': date.month,
-            'name': date.strftime('%B'),
-            'is_current': (date.year == current_date.year and date.month == current_date.month),
-            'award': awards.get((date.year, date.month))
-        })
+    months = month_cards(selected_year, selected_month, awards, current_date)
 
     return render_template("awards.html",
                          student=student,
@@ -628,14 +715,12 @@ def update_award():
     month = int(request.form.get("month"))
     award = int(request.form.get("award"))
 
-    conn = sqlite3.connect("school.db")
-    cursor = conn.cursor()
+    if award not in queries.AWARD_VALUES:
+        return jsonify({'status': 'error', 'message': 'Недопустимая награда'}), 400
+
+    conn = get_db()
     try:
-        cursor.execute("""
-            INSERT OR REPLACE INTO monthly_awards 
-            (student_id, year, month, award) 
-            VALUES (?, ?, ?, ?)
-        """, (student_id, year, month, award))
+        queries.save_award(conn, student_id, year, month, award)
         conn.commit()
         return jsonify({'status': 'success'})
     except Exception as e:
@@ -645,6 +730,158 @@ def update_award():
         conn.close()
 
 
+@app.route("/admin/shards_report")
+@login_required
+@admin_required
+def shards_report():
+    """Сводка по всем школам: ученики, уроки и монеты в каждом шарде.
+
+    Отчёт читает снимки только для чтения, а не живые базы. Устаревшие
+    снимки обновляются в фоне; пока снимка нет, отвечаем 503.
+    """
+    sql = """
+        SELECT
+            (SELECT COUNT(*) FROM {shard}.students) AS students,
+            (SELECT COUNT(*) FROM {shard}.lessons) AS lessons,
+            (SELECT COALESCE(SUM(COALESCE(understanding, 0) + COALESCE(participation, 0)
+                                 + CAST(COALESCE(NULLIF(homework, ''), '0') AS INTEGER)), 0)
+             FROM {shard}.lessons) AS coins
+    """
+    not_ready = jsonify({'error': 'Снимки готовятся, повторите запрос позже'}), 503
+
+    if not router.enabled:
+        conn = get_snapshot(DB_PATH).connect()
+        if conn is None:
+            return not_ready
+        try:
+            row = conn.execute(sql.format(shard='main')).fetchone()
+        finally:
+            conn.close()
+        return jsonify({'shards': [dict(row, tenant=None)]})
+
+    snapshots = {tenant: get_snapshot(router.shard_path(tenant)).current_path()
+                 for tenant in router.tenants()}
+    if None in snapshots.values():
+        return not_ready
+    rows = router.cross_shard_query(sql, paths=snapshots)
+    return jsonify({'shards': [dict(row) for row in rows]})
+
+
+@app.cli.command("split-shards")
+def split_shards_command():
+    """Разносит school.db по отдельным базам учителей"""
+    if not router.enabled:
+        print("Укажите каталог шардов в переменной SCHOOL_SHARDS_DIR")
+        return
+    for tenant, count in router.split_by_teacher().items():
+        print(f"{tenant}: учеников {count}")
+
+
+@app.route("/admin/compression_stats")
+@login_required
+@admin_required
+def compression_stats():
+    """Исходные и сжатые байты по маршрутам в этом процессе"""
+    return jsonify(compression.stats.snapshot())
+
+
+@app.route("/admin/rate_limits")
+@login_required
+@admin_required
+def rate_limits():
+    """Пропущенные и отклонённые запросы по лимитам в этом процессе"""
+    return jsonify(ratelimit.counters.snapshot())
+
+
+@app.route("/admin/backup", methods=["GET", "POST"])
+@login_required
+@admin_required
+def admin_backup():
+    """Онлайн-копия всех баз в фоне; GET показывает задачи этого процесса.
+
+    Копирование идёт дольше таймаута воркера, поэтому запрос его только
+    запускает. Большие базы надёжнее копировать командой ``flask backup``.
+    """
+    if request.method == 'POST':
+        started = backup_jobs.start('backup', backup_all, all_db_paths(), app.config['BACKUP_DIR'])
+        return jsonify({'status': 'started' if started else 'running'}), 202
+    return jsonify(backup_jobs.snapshot())
+
+
+@app.cli.command("backup")
+def backup_command():
+    """Делает резервную копию всех баз в SCHOOL_BACKUP_DIR"""
+    for path in backup_all(all_db_paths(), app.config['BACKUP_DIR']):
+        print(f"Сохранено: {path}")
+
+
+@app.cli.command("snapshot")
+def snapshot_command():
+    """Обновляет снимки для отчётов (удобно запускать по cron)"""
+    for src_path in all_db_paths():
+        path = get_snapshot(src_path).refresh()
+        print(f"Снимок обновлён: {path}")
+
+
+@app.cli.command("warm-templates")
+def warm_templates_command():
+    """Компилирует все шаблоны в общий кеш байткода (запускать при деплое)"""
+    names = [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+    for name in names:
+        app.jinja_env.get_template(name)
+    print(f"Скомпилировано шаблонов: {len(names)}")
+
+
+@app.cli.command("bench-render")
+@click.option("--runs", default=500, help="Сколько раз рендерить страницу")
+@click.option("--template-dir", default=None,
+              help="Каталог с другой версией шаблонов, например из прошлого коммита")
+def bench_render_command(runs, template_dir):
+    """Замеряет компиляцию и среднее время рендеринга student.html.
+
+    Контекст подходит и для старой версии шаблона (8 колонок урока,
+    ``awards`` и ``relativedelta``), поэтому «до» и «после» меряются одним
+    и тем же кодом. Подготовка данных входит в замер рендеринга в обоих
+    случаях, так что выигрыш скорее занижен.
+    """
+    env = app.jinja_env
+    if template_dir:
+        env = env.overlay(loader=FileSystemLoader(template_dir))
+
+    def load_time(bytecode_cache):
+        cold = env.overlay(cache_size=0, bytecode_cache=bytecode_cache)
+        started = time.perf_counter()
+        cold.get_template("student.html")
+        return (time.perf_counter() - started) * 1000
+
+    student = (1, "Ученик", "A1", "2024-09-01", "Цель", 1, "admin")
+    rows = [(i, 1, "2024-09-01", f"Урок {i}", i % 6, (i + 2) % 6, str(i % 4), 0)
+            for i in range(1, queries.LESSONS_PER_STUDENT + 1)]
+    now = datetime.now()
+    awards = {(now.year, now.month): 1, (now.year - 1, 12): 3}
+
+    with app.test_request_context("/student/1"):
+        session['is_teacher'] = True
+        print(f"student.html: компиляция из исходника {load_time(None):.1f} мс")
+        if env.bytecode_cache is not None:
+            load_time(env.bytecode_cache)  # прогрев кеша
+            print(f"student.html: загрузка из кеша байткода {load_time(env.bytecode_cache):.1f} мс")
+
+        template = env.get_template("student.html")
+        started = time.perf_counter()
+        for _ in range(runs):
+            lessons = [lesson_display(row) for row in rows]
+            context = dict(student=student, lessons=lessons,
+                           month_cards=month_cards(now.year, now.month, awards, now),
+                           awards=awards, current_date=now, relativedelta=relativedelta,
+                           total_coins=sum(l[4] + l[5] + int(l[6]) for l in lessons),
+                           sync_token=0, is_current_teacher=True)
+            app.update_template_context(context)
+            template.render(context)
+        elapsed = time.perf_counter() - started
+    print(f"student.html: {elapsed / runs * 1000:.3f} мс на рендер ({runs} раз)")
+
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 10000))
     app.run(host="0.0.0.0", port=port)
\ No newline at end of file
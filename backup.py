@@ -0,0 +1,193 @@
+"""Резервные копии и снимки для отчётов без остановки сервиса.
+
+Копирование идёт через ``sqlite3.Connection.backup`` небольшими порциями
+страниц с паузами между ними, поэтому блокировка на запись у рабочих
+процессов gunicorn держится только на время одной порции. Из веб-запросов
+копии запускаются в фоне (``jobs``); большие базы лучше копировать
+командой ``flask backup`` по cron.
+"""
+import glob
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Страниц за один шаг и пауза между шагами (секунды)
+BACKUP_PAGES = 256
+BACKUP_SLEEP = 0.05
+
+# Запись из другого соединения заставляет SQLite начать копирование заново.
+# Тогда ждём, пока поток записей схлынет, и пробуем снова более крупными
+# шагами; блокировка по-прежнему держится не дольше одного шага
+MAX_RESTARTS = 6
+BACKUP_MAX_PAGES = 4096
+BACKOFF_MAX_SLEEP = 5
+
+
+class BackupError(Exception):
+    """Резервную копию не удалось сделать"""
+
+
+class _Restarted(Exception):
+    pass
+
+
+def readonly_uri(path):
+    """URI файла базы, которую SQLite откроет только для чтения"""
+    return Path(path).resolve().as_uri() + "?mode=ro"
+
+
+def _copy(src_path, tmp_path, pages, sleep):
+    src = sqlite3.connect(src_path)
+    dest = sqlite3.connect(tmp_path)
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal last_remaining
+        if last_remaining is not None and remaining >= last_remaining:
+            raise _Restarted()
+        last_remaining = remaining
+        # Отдаём блокировку писателям между порциями страниц
+        time.sleep(sleep)
+
+    try:
+        src.backup(dest, pages=pages, progress=progress)
+    finally:
+        dest.close()
+        src.close()
+
+
+def _remove_stale_tmp(dest_path):
+    """Удаляет временные файлы процессов, погибших посреди копирования"""
+    for tmp_path in glob.glob(glob.escape(dest_path) + ".*.tmp"):
+        try:
+            os.kill(int(tmp_path[len(dest_path) + 1:].split(".")[0]), 0)
+        except ValueError:
+            continue
+        except ProcessLookupError:
+            os.remove(tmp_path)
+        except PermissionError:
+            pass
+
+
+def online_backup(src_path, dest_path, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP):
+    """Копирует живую базу в ``dest_path``.
+
+    Копия сначала пишется во временный файл и затем атомарно заменяет
+    ``dest_path``, поэтому читатели никогда не видят недописанный файл.
+    Если записи перезапускают копирование, после паузы оно повторяется
+    с удвоенными паузой и размером шага (до ``BACKUP_MAX_PAGES``). Если
+    за ``MAX_RESTARTS`` попыток копия не получилась, выбрасывается
+    ``BackupError``; писатели при этом не блокируются дольше одного шага.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+    _remove_stale_tmp(dest_path)
+    # У каждого процесса свой временный файл, чтобы воркеры не мешали друг другу
+    tmp_path = f"{dest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        for attempt in range(MAX_RESTARTS + 1):
+            try:
+                _copy(src_path, tmp_path, pages, sleep)
+                break
+            except _Restarted:
+                time.sleep(min(BACKOFF_MAX_SLEEP, sleep * 2 ** (attempt + 1)))
+                pages = min(BACKUP_MAX_PAGES, pages * 2)
+        else:
+            raise BackupError(f"{src_path} меняется слишком часто, копия не завершена")
+        os.replace(tmp_path, dest_path)
+    except sqlite3.Error as e:
+        raise BackupError(f"Не удалось скопировать {src_path}: {e}") from e
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return dest_path
+
+
+def backup_all(paths, backup_dir):
+    """Делает копии всех баз в подкаталог с отметкой времени"""
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    target_dir = os.path.join(backup_dir, stamp)
+    return [
+        online_backup(path, os.path.join(target_dir, os.path.basename(path)))
+        for path in paths
+    ]
+
+
+class Snapshot:
+    """Периодически обновляемая копия базы только для чтения.
+
+    Тяжёлые отчёты и выгрузки читают снимок, не мешая живой базе.
+    Снимок обновляется при обращении, если он старше ``max_age`` секунд.
+    """
+
+    def __init__(self, src_path, snapshot_path, max_age=300):
+        self.src_path = src_path
+        self.snapshot_path = snapshot_path
+        self.max_age = max_age
+
+    def is_stale(self):
+        if not os.path.exists(self.snapshot_path):
+            return True
+        return time.time() - os.path.getmtime(self.snapshot_path) > self.max_age
+
+    def refresh(self):
+        return online_backup(self.src_path, self.snapshot_path)
+
+    def current_path(self):
+        """Путь к имеющемуся снимку или None, если его ещё нет.
+
+        Устаревший снимок обновляется в фоне, а запрос читает прежний,
+        чтобы не ждать копирования большой базы.
+        """
+        if self.is_stale():
+            jobs.start(f"snapshot:{self.snapshot_path}", self.refresh)
+        return self.snapshot_path if os.path.exists(self.snapshot_path) else None
+
+    def connect(self):
+        """Соединение с имеющимся снимком только для чтения или None"""
+        path = self.current_path()
+        if path is None:
+            return None
+        conn = sqlite3.connect(readonly_uri(path), uri=True)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+
+class BackgroundJobs:
+    """Копирования, запущенные в фоне этого процесса: не больше одного на ключ"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = set()
+        self._results = {}
+
+    def start(self, key, func, *args):
+        """Запускает ``func`` в фоновом потоке; False, если задача уже идёт"""
+        with self._lock:
+            if key in self._running:
+                return False
+            self._running.add(key)
+        threading.Thread(target=self._run, args=(key, func, args), daemon=True).start()
+        return True
+
+    def _run(self, key, func, args):
+        try:
+            result = {'status': 'success', 'result': func(*args)}
+        except Exception as e:
+            result = {'status': 'error', 'message': str(e)}
+        result['finished'] = datetime.now().isoformat(timespec='seconds')
+        with self._lock:
+            self._running.discard(key)
+            self._results[key] = result
+
+    def snapshot(self):
+        with self._lock:
+            status = {key: dict(result) for key, result in self._results.items()}
+            for key in self._running:
+                status.setdefault(key, {})['running'] = True
+            return status
+
+
+jobs = BackgroundJobs()
@@ -0,0 +1,146 @@
+"""Сжатие ответов (gzip и brotli) по заголовку Accept-Encoding.
+
+Brotli (пакет ``Brotli`` из requirements.txt) предпочитается, если клиент
+его поддерживает; без пакета остаётся gzip из стандартной библиотеки. Для каждого маршрута считаются
+байты до и после сжатия.
+"""
+import gzip
+import threading
+import zlib
+from collections import defaultdict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # без Brotli отдаём только gzip
+    brotli = None
+
+# Ответы меньше порога не сжимаем: выигрыш меньше накладных расходов
+MIN_SIZE = 500
+COMPRESSIBLE_TYPES = (
+    'text/html', 'text/css', 'text/plain', 'text/javascript',
+    'application/json', 'application/javascript',
+)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Потоковый ответ сбрасывается клиенту, когда накопится столько исходных байт:
+# сброс после каждой мелкой части почти сводит сжатие на нет
+STREAM_FLUSH_SIZE = 16 * 1024
+
+
+class CompressionStats:
+    """Счётчики исходных и сжатых байтов по маршрутам"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = defaultdict(lambda: {'responses': 0, 'raw_bytes': 0, 'compressed_bytes': 0})
+
+    def add(self, route, raw, compressed):
+        with self._lock:
+            stats = self._routes[route]
+            stats['responses'] += 1
+            stats['raw_bytes'] += raw
+            stats['compressed_bytes'] += compressed
+
+    def snapshot(self):
+        with self._lock:
+            return {route: dict(stats) for route, stats in self._routes.items()}
+
+
+stats = CompressionStats()
+
+
+def choose_encoding(accept_encoding):
+    """Выбирает лучшую кодировку из поддерживаемых клиентом"""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.lower()] = quality
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def _stream(chunks, encoding, route):
+    """Сжимает потоковый ответ по частям"""
+    raw = compressed = pending = 0
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        flush, finish = compressor.flush, compressor.finish
+        compress = compressor.process
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+        finish, compress = compressor.flush, compressor.compress
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            raw += len(chunk)
+            pending += len(chunk)
+            data = compress(chunk)
+            if pending >= STREAM_FLUSH_SIZE:
+                data += flush()
+                pending = 0
+            compressed += len(data)
+            if data:
+                yield data
+        data = finish()
+        compressed += len(data)
+        yield data
+    finally:
+        stats.add(route, raw, compressed)
+
+
+def compress_response(response):
+    """Обработчик after_request: сжимает ответ, если это выгодно"""
+    if (response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+    if encoding is None:
+        return response
+
+    route = request.url_rule.rule if request.url_rule else request.path
+
+    if response.is_streamed:
+        response.direct_passthrough = False
+        response.response = _stream(response.response, encoding, route)
+        response.headers.pop('Content-Length', None)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    data = response.get_data()
+    if len(data) < MIN_SIZE:
+        return response
+
+    if encoding == 'br':
+        body = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        body = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    stats.add(route, len(data), len(body))
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_compression(app):
+    """Подключает сжатие ответов к приложению"""
+    app.after_request(compress_response)
@@ -0,0 +1,205 @@
+"""Слой доступа к данным: все запросы приложения в одном месте.
+
+Функции принимают открытое соединение и возвращают компактные кортежи
+(без ``sqlite3.Row``), поэтому шаблоны и маршруты обращаются к колонкам
+по индексу.
+"""
+from datetime import datetime
+
+# Сколько уроков показывается на странице ученика
+LESSONS_PER_STUDENT = 8
+
+AWARD_VALUES = (1, 2, 3, 4)
+
+
+def _cursor(conn):
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    return cursor
+
+
+def _one(conn, sql, params=()):
+    return _cursor(conn).execute(sql, params).fetchone()
+
+
+def _all(conn, sql, params=()):
+    return _cursor(conn).execute(sql, params).fetchall()
+
+
+# Пользователи
+
+def user_by_username(conn, username):
+    """(id, username, password, is_teacher, role)"""
+    return _one(conn, """
+        SELECT id, username, password, is_teacher, role FROM users WHERE username = ?
+    """, (username,))
+
+
+def create_user(conn, username, password_hash, role, is_teacher):
+    cursor = _cursor(conn)
+    cursor.execute(
+        "INSERT INTO users (username, password, role, is_teacher) VALUES (?, ?, ?, ?)",
+        (username, password_hash, role, 1 if is_teacher else 0)
+    )
+    return cursor.lastrowid
+
+
+def has_teacher(conn):
+    return _one(conn, "SELECT 1 FROM users WHERE is_teacher = 1 LIMIT 1") is not None
+
+
+# Ученики
+
+def teacher_students(conn, teacher_id):
+    """(id, name, level) учеников учителя"""
+    return _all(conn, """
+        SELECT id, name, level FROM students WHERE teacher_id = ? ORDER BY id
+    """, (teacher_id,))
+
+
+def parent_students(conn, user_id, tenant=None):
+    """(id, name, level, tenant) учеников, привязанных к родителю"""
+    return _all(conn, """
+        SELECT s.id, s.name, s.level, ?
+        FROM students s
+        JOIN parents p ON s.id = p.student_id
+        WHERE p.user_id = ?
+    """, (tenant, user_id))
+
+
+def search_students_sql(terms):
+    """Запрос поиска по словам имени и его параметры.
+
+    Таблица учеников указана как ``{shard}.students``, чтобы тот же текст
+    подходил для ``ShardRouter.cross_shard_query``.
+    """
+    sql = """
+        SELECT s.id, s.name, s.level, s.start_date, s.goal, u.username
+        FROM {{shard}}.students s
+        LEFT JOIN users u ON s.teacher_id = u.id
+        WHERE {}
+    """.format(" AND ".join(["s.name LIKE ?"] * len(terms)))
+    return sql, [f'%{term}%' for term in terms]
+
+
+def search_students(conn, terms, tenant=None):
+    """(id, name, level, start_date, goal, teacher_name, tenant) по словам имени"""
+    sql, params = search_students_sql(terms)
+    rows = _all(conn, sql.format(shard='main') + " ORDER BY s.name", params)
+    return [row + (tenant,) for row in rows]
+
+
+def student_for_teacher(conn, student_id, teacher_id):
+    """(id, name, level, start_date, goal, teacher_id, teacher_name)"""
+    return _one(conn, """
+        SELECT s.id, s.name, s.level, s.start_date, s.goal, s.teacher_id, u.username
+        FROM students s
+        LEFT JOIN users u ON s.teacher_id = u.id
+        WHERE s.id = ? AND s.teacher_id = ?
+    """, (student_id, teacher_id))
+
+
+def student_for_parent(conn, student_id, user_id):
+    """(id, name, level, start_date, goal, teacher_id, teacher_name)"""
+    return _one(conn, """
+        SELECT s.id, s.name, s.level, s.start_date, s.goal, s.teacher_id, u.username
+        FROM students s
+        LEFT JOIN users u ON s.teacher_id = u.id
+        JOIN parents p ON s.id = p.student_id
+        WHERE s.id = ? AND p.user_id = ?
+    """, (student_id, user_id))
+
+
+def student_brief(conn, student_id):
+    """(id, name) или None"""
+    return _one(conn, "SELECT id, name FROM students WHERE id = ?", (student_id,))
+
+
+def add_student(conn, name, level, start_date, goal, teacher_id):
+    _cursor(conn).execute(
+        "INSERT INTO students (name, level, start_date, goal, teacher_id) VALUES (?, ?, ?, ?, ?)",
+        (name, level, start_date, goal, teacher_id)
+    )
+
+
+def link_parent(conn, user_id, student_id):
+    _cursor(conn).execute(
+        "INSERT OR IGNORE INTO parents (user_id, student_id) VALUES (?, ?)",
+        (user_id, student_id)
+    )
+
+
+# Уроки
+
+def ensure_lessons(conn, student_id):
+    """Создаёт недостающие уроки до LESSONS_PER_STUDENT одним пакетом"""
+    count = _one(conn, "SELECT COUNT(*) FROM lessons WHERE student_id = ?", (student_id,))[0]
+    if count >= LESSONS_PER_STUDENT:
+        return False
+    today = datetime.now().strftime("%Y-%m-%d")
+    _cursor(conn).executemany(
+        "INSERT INTO lessons (student_id, date, topic) VALUES (?, ?, ?)",
+        [(student_id, today, f"Урок {i}") for i in range(count + 1, LESSONS_PER_STUDENT + 1)]
+    )
+    return True
+
+
+def student_lessons(conn, student_id):
+    """(id, student_id, date, topic, understanding, participation, homework, version)"""
+    return _all(conn, """
+        SELECT id, student_id, date, topic,
+               COALESCE(understanding, 0),
+               COALESCE(participation, 0),
+               COALESCE(NULLIF(homework, ''), '0'),
+               version
+        FROM lessons
+        WHERE student_id = ?
+        ORDER BY id ASC
+        LIMIT ?
+    """, (student_id, LESSONS_PER_STUDENT))
+
+
+def teacher_owns_lesson(conn, lesson_id, teacher_id):
+    return _one(conn, """
+        SELECT 1 FROM lessons l
+        JOIN students s ON l.student_id = s.id
+        WHERE l.id = ? AND s.teacher_id = ?
+    """, (lesson_id, teacher_id)) is not None
+
+
+# Награды
+
+def student_awards(conn, student_id):
+    """Словарь {(год, месяц): награда}"""
+    return {
+        (year, month): award for year, month, award in _all(conn, """
+            SELECT year, month, award FROM monthly_awards WHERE student_id = ?
+        """, (student_id,))
+    }
+
+
+def save_award(conn, student_id, year, month, award):
+    _cursor(conn).execute("""
+        INSERT OR REPLACE INTO monthly_awards (student_id, year, month, award)
+        VALUES (?, ?, ?, ?)
+    """, (student_id, year, month, award))
+
+
+def migrate_trophies(conn):
+    """Однократно переносит кубки из старой таблицы monthly_trophies.
+
+    Таблицу создавало отдельное приложение ``templates/main.py``. Уже
+    выставленные награды не перезаписываются. Возвращает число
+    перенесённых строк.
+    """
+    if _one(conn, "SELECT 1 FROM sqlite_master WHERE type='table' AND name='monthly_trophies'") is None:
+        return 0
+    cursor = _cursor(conn)
+    cursor.execute("""
+        INSERT OR IGNORE INTO monthly_awards (student_id, year, month, award)
+        SELECT student_id, year, month, trophy FROM monthly_trophies
+    """)
+    moved = cursor.rowcount
+    cursor.execute("DROP TABLE monthly_trophies")
+    conn.commit()
+    return moved
@@ -0,0 +1,167 @@
+"""Ограничение частоты запросов по алгоритму token bucket.
+
+Корзины хранятся в памяти процесса или, чтобы лимиты действовали сразу
+для всех воркеров gunicorn, в общем файле SQLite. Проверка лимита дешёвая
+и выполняется до хеширования паролей и запросов к основной базе.
+"""
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+# Сколько корзин держать в памяти, прежде чем выбросить заполненные
+MAX_MEMORY_BUCKETS = 10000
+
+# Общий файл чистится от заполненных корзин не чаще, чем раз в столько секунд
+SQLITE_PRUNE_INTERVAL = 60
+
+
+class StoreBusy(Exception):
+    """Общее хранилище занято другим воркером дольше таймаута"""
+
+
+def _refill(bucket, rate, capacity, now):
+    """Списывает жетон; возвращает (разрешено, жетоны, момент полного заполнения)"""
+    tokens, updated = bucket if bucket else (capacity, now)
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    allowed = tokens >= 1
+    if allowed:
+        tokens -= 1
+    return allowed, tokens, now + (capacity - tokens) / rate
+
+
+class MemoryStore:
+    """Корзины в памяти одного процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._prune_at = MAX_MEMORY_BUCKETS
+
+    def take(self, key, rate, capacity, now):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            allowed, tokens, full_at = _refill(bucket and bucket[:2], rate, capacity, now)
+            self._buckets[key] = (tokens, now, full_at)
+            if len(self._buckets) > self._prune_at:
+                self._prune(now)
+            return allowed
+
+    def _prune(self, now):
+        # Полные корзины ничем не отличаются от отсутствующих. Момент заполнения
+        # хранится в самой корзине, поэтому лимиты с разной ёмкостью не мешают
+        # друг другу
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items() if bucket[2] > now
+        }
+        # Если почти все корзины активны, не пересобираем словарь на каждом вызове
+        self._prune_at = max(MAX_MEMORY_BUCKETS, 2 * len(self._buckets))
+
+
+class SQLiteStore:
+    """Корзины в общем файле SQLite, видимом всем воркерам"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._pruned = 0
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                full_at REAL NOT NULL DEFAULT 0
+            )
+        """)
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(buckets)")}
+        if 'full_at' not in existing:
+            conn.execute("ALTER TABLE buckets ADD COLUMN full_at REAL NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_buckets_full_at ON buckets(full_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, capacity, now):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            raise StoreBusy()
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            allowed, tokens, full_at = _refill(row, rate, capacity, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)",
+                (key, tokens, now, full_at)
+            )
+            if now - self._pruned > SQLITE_PRUNE_INTERVAL:
+                conn.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+                self._pruned = now
+            conn.execute("COMMIT")
+        except sqlite3.OperationalError:
+            conn.execute("ROLLBACK")
+            raise StoreBusy()
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed
+
+
+class RateLimiter:
+    """Лимит: ``capacity`` запросов подряд и ``per_minute`` в минуту в среднем.
+
+    Если общее хранилище занято, запрос пропускается (``fail_open=True``)
+    или отклоняется; такие случаи считаются отдельно в счётчике ``busy``.
+    """
+
+    def __init__(self, name, store, per_minute, capacity, fail_open=True):
+        self.name = name
+        self.store = store
+        self.rate = per_minute / 60.0
+        self.capacity = capacity
+        self.fail_open = fail_open
+
+    def allow(self, key):
+        try:
+            allowed = self.store.take(f"{self.name}:{key}", self.rate, self.capacity, time.time())
+        except StoreBusy:
+            counters.add(self.name, self.fail_open, busy=True)
+            return self.fail_open
+        counters.add(self.name, allowed)
+        return allowed
+
+
+class Counters:
+    """Число пропущенных и отклонённых запросов по лимитам"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: {'allowed': 0, 'rejected': 0, 'busy': 0})
+
+    def add(self, name, allowed, busy=False):
+        with self._lock:
+            counts = self._counts[name]
+            counts['allowed' if allowed else 'rejected'] += 1
+            if busy:
+                counts['busy'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(counts) for name, counts in self._counts.items()}
+
+
+counters = Counters()
+
+
+def make_store(path=None):
+    """Общее хранилище, если указан файл, иначе память процесса"""
+    return SQLiteStore(path) if path else MemoryStore()
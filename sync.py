@@ -0,0 +1,190 @@
+"""Пакетная синхронизация оценок с офлайн-клиентом.
+
+Каждый урок хранит номер версии (``version``), время последней правки
+(``updated_at``, мс) и порядковый номер изменения в базе (``change_seq``).
+Клиент присылает накопленные правки одним пакетом и токен последней
+синхронизации, а в ответ получает только уроки, изменённые после токена.
+"""
+import time
+
+SYNC_FIELDS = ('understanding', 'participation', 'homework')
+
+# Сколько хранить идентификаторы применённых правок для защиты от повторов
+SYNC_EDITS_TTL = 30 * 24 * 3600 * 1000
+
+SYNC_COLUMNS = (
+    ('version', 'INTEGER NOT NULL DEFAULT 0'),
+    ('updated_at', 'INTEGER NOT NULL DEFAULT 0'),
+    ('change_seq', 'INTEGER NOT NULL DEFAULT 0'),
+)
+
+
+def ensure_sync_schema(conn):
+    """Добавляет в существующую базу колонки и таблицы для синхронизации"""
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(lessons)")}
+    for name, definition in SYNC_COLUMNS:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE lessons ADD COLUMN {name} {definition}")
+    conn.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_lessons_change_seq ON lessons(change_seq);
+        CREATE INDEX IF NOT EXISTS idx_lessons_student_seq ON lessons(student_id, change_seq);
+
+        CREATE TABLE IF NOT EXISTS sync_edits (
+            edit_id TEXT PRIMARY KEY,
+            applied INTEGER NOT NULL,
+            seen_at INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(sync_edits)")}
+    if 'seen_at' not in existing:
+        conn.execute("ALTER TABLE sync_edits ADD COLUMN seen_at INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sync_edits_seen_at ON sync_edits(seen_at)")
+    conn.commit()
+
+
+def lock_lessons(cursor):
+    """Начинает транзакцию и берёт блокировку записи только на базу уроков.
+
+    ``BEGIN IMMEDIATE`` заблокировал бы и подключённый к шарду справочник,
+    то есть снова один писатель на все школы. Пустой UPDATE по таблице
+    основной базы блокирует лишь её.
+    """
+    cursor.execute("BEGIN")
+    cursor.execute("UPDATE lessons SET change_seq = change_seq WHERE id = -1")
+
+
+def next_change_seq(cursor):
+    """Следующий номер изменения; вызывать после ``lock_lessons``"""
+    cursor.execute("SELECT COALESCE(MAX(change_seq), 0) + 1 FROM lessons")
+    return cursor.fetchone()[0]
+
+
+def write_lesson_field(cursor, lesson_id, field, value):
+    """Записывает одно поле урока, увеличивая его версию и номер изменения.
+
+    Номер изменения вычисляется в том же UPDATE, уже под блокировкой
+    записи, поэтому два воркера не могут получить одинаковый номер.
+    """
+    if field not in SYNC_FIELDS:
+        raise ValueError(f"Недопустимое поле урока: {field}")
+    cursor.execute(f"""
+        UPDATE lessons
+        SET {field} = ?, version = version + 1, updated_at = ?,
+            change_seq = (SELECT COALESCE(MAX(change_seq), 0) + 1 FROM lessons)
+        WHERE id = ?
+    """, (value, int(time.time() * 1000), lesson_id))
+
+
+def current_token(cursor, student_id):
+    cursor.execute(
+        "SELECT COALESCE(MAX(change_seq), 0) FROM lessons WHERE student_id = ?",
+        (student_id,)
+    )
+    return cursor.fetchone()[0]
+
+
+def _coerce(field, value):
+    value = int(value)
+    if not 0 <= value <= 5:
+        raise ValueError(f"Недопустимое число монет: {value}")
+    return str(value) if field == 'homework' else value
+
+
+def apply_batch(conn, teacher_id, student_id, edits, since):
+    """Применяет пакет правок в одной транзакции.
+
+    Правка применяется, если клиент видел текущую версию урока, либо если
+    она новее последней записи (побеждает последний писатель). Повторно
+    присланные правки с уже известным ``id`` пропускаются; идентификаторы
+    хранятся ``SYNC_EDITS_TTL``. Ученик должен принадлежать учителю,
+    это проверяет вызывающий код. Правки
+    применяются в порядке номера ``seq``, который клиент увеличивает
+    с каждой правкой, затем по времени. Возвращает
+    ``(applied, conflicts, token, changes)``, где ``changes`` — кортежи
+    ``(id, understanding, participation, homework, version)``.
+    """
+    cursor = conn.cursor()
+    applied, conflicts = [], []
+    stale = set()  # уроки, по которым клиенту нужно вернуть актуальное состояние
+
+    if not all(isinstance(edit, dict) for edit in edits):
+        raise ValueError("Правка должна быть объектом")
+    # Порядок в пакете задаёт клиент, а не ключи IndexedDB (случайные UUID)
+    edits = sorted(edits, key=lambda edit: (int(edit.get('seq', 0)),
+                                            int(edit.get('ts', 0)),
+                                            str(edit['id'])))
+
+    lock_lessons(cursor)
+    try:
+        cursor.execute("""
+            SELECT l.id, l.version, l.updated_at FROM lessons l
+            JOIN students s ON l.student_id = s.id
+            WHERE l.student_id = ? AND s.teacher_id = ?
+        """, (student_id, teacher_id))
+        lessons = {row[0]: [row[1], row[2]] for row in cursor.fetchall()}
+        # Правки одного пакета основаны на версиях до его применения
+        base_versions = {lesson_id: state[0] for lesson_id, state in lessons.items()}
+
+        seq = next_change_seq(cursor)
+        now = int(time.time() * 1000)
+        cursor.execute("DELETE FROM sync_edits WHERE seen_at < ?", (now - SYNC_EDITS_TTL,))
+        for edit in edits:
+            edit_id = str(edit['id'])
+            cursor.execute("SELECT applied FROM sync_edits WHERE edit_id = ?", (edit_id,))
+            seen = cursor.fetchone()
+            if seen:
+                (applied if seen[0] else conflicts).append(edit_id)
+                continue
+
+            lesson_id = int(edit['lesson_id'])
+            field = edit['field']
+            client_ts = int(edit.get('ts', 0))
+            if lesson_id not in lessons or field not in SYNC_FIELDS:
+                conflicts.append(edit_id)
+                continue
+
+            try:
+                value = _coerce(field, edit['value'])
+            except (TypeError, ValueError):
+                conflicts.append(edit_id)
+                continue
+
+            version, updated_at = lessons[lesson_id]
+            base_version = int(edit.get('base_version', -1))
+            ok = (base_version in (version, base_versions[lesson_id])
+                  or client_ts >= updated_at)
+            if ok:
+                cursor.execute(f"""
+                    UPDATE lessons
+                    SET {field} = ?, version = version + 1,
+                        updated_at = ?, change_seq = ?
+                    WHERE id = ?
+                """, (value, max(client_ts, updated_at), seq, lesson_id))
+                lessons[lesson_id] = [version + 1, max(client_ts, updated_at)]
+                applied.append(edit_id)
+            else:
+                conflicts.append(edit_id)
+                stale.add(lesson_id)
+            cursor.execute(
+                "INSERT INTO sync_edits (edit_id, applied, seen_at) VALUES (?, ?, ?)",
+                (edit_id, 1 if ok else 0, now)
+            )
+
+        cursor.execute("""
+            SELECT l.id, COALESCE(l.understanding, 0), COALESCE(l.participation, 0),
+                   CAST(COALESCE(NULLIF(l.homework, ''), '0') AS INTEGER), l.version
+            FROM lessons l
+            JOIN students s ON l.student_id = s.id
+            WHERE l.student_id = ? AND s.teacher_id = ?
+              AND (l.change_seq > ? OR l.id IN ({}))
+            ORDER BY l.id
+        """.format(", ".join("?" * len(stale)) or "NULL"),
+            (student_id, teacher_id, since, *stale))
+        changes = [tuple(row) for row in cursor.fetchall()]
+        token = current_token(cursor, student_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return applied, conflicts, token, changes
@@ -0,0 +1,315 @@
+"""Мультитенантный режим: отдельный файл базы данных для каждой школы.
+
+Общая база (``school.db``) остаётся справочником пользователей и хранит
+привязку учителя к его школе в таблице ``user_tenants``, а родителя — ко
+всем школам его детей в таблице ``parent_tenants``. Ученики, уроки,
+награды и связи с родителями живут в файлах ``<SHARDS_DIR>/<tenant>.db``.
+Каждое соединение с шардом подключает справочник через ``ATTACH``, поэтому
+запросы с ``JOIN users`` работают без изменений.
+"""
+import os
+import re
+import sqlite3
+
+from backup import readonly_uri
+from sync import ensure_sync_schema
+
+# Имя школы становится именем файла, поэтому допускаем только безопасные символы
+TENANT_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# SQLite по умолчанию разрешает не более 10 подключённых баз на соединение
+MAX_ATTACHED = 8
+
+# Ключи, по которым строка источника считается перенесённой в шард
+MOVE_KEYS = (
+    ('lessons', 'id, student_id'),
+    ('monthly_awards', 'student_id, year, month'),
+    ('parents', 'user_id, student_id'),
+)
+
+SHARD_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS students (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        level TEXT,
+        start_date TEXT,
+        goal TEXT,
+        teacher_id INTEGER
+    );
+
+    CREATE TABLE IF NOT EXISTS lessons (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        understanding INTEGER DEFAULT 0,
+        participation INTEGER DEFAULT 0,
+        homework TEXT,
+        FOREIGN KEY (student_id) REFERENCES students(id)
+    );
+
+    CREATE TABLE IF NOT EXISTS monthly_awards (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id INTEGER NOT NULL,
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        award INTEGER,
+        FOREIGN KEY (student_id) REFERENCES students(id),
+        UNIQUE(student_id, year, month)
+    );
+
+    CREATE TABLE IF NOT EXISTS parents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        student_id INTEGER NOT NULL,
+        FOREIGN KEY (student_id) REFERENCES students(id),
+        UNIQUE(user_id, student_id)
+    );
+"""
+
+
+def teacher_tenant(teacher_id):
+    """Имя шарда по умолчанию для учителя"""
+    return f"teacher_{teacher_id}"
+
+
+class ShardRouter:
+    """Выдаёт соединения с базой школы текущего пользователя"""
+
+    def __init__(self, directory_path, shards_dir=None):
+        self.directory_path = directory_path
+        self.shards_dir = shards_dir
+
+    @property
+    def enabled(self):
+        return bool(self.shards_dir)
+
+    def _connect(self, path):
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def directory(self):
+        """Соединение со справочником пользователей"""
+        return self._connect(self.directory_path)
+
+    def init_directory(self):
+        """Создаёт таблицы привязки пользователей к школам"""
+        conn = self.directory()
+        try:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS user_tenants (
+                    user_id INTEGER PRIMARY KEY,
+                    tenant TEXT NOT NULL,
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                );
+
+                -- У родителя могут быть дети у разных учителей, то есть в разных шардах
+                CREATE TABLE IF NOT EXISTS parent_tenants (
+                    user_id INTEGER NOT NULL,
+                    tenant TEXT NOT NULL,
+                    PRIMARY KEY (user_id, tenant),
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                );
+            """)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def shard_path(self, tenant):
+        if not TENANT_RE.match(tenant or ''):
+            raise ValueError(f"Недопустимое имя школы: {tenant!r}")
+        return os.path.join(self.shards_dir, f"{tenant}.db")
+
+    def tenants(self):
+        """Список всех существующих шардов"""
+        if not self.enabled or not os.path.isdir(self.shards_dir):
+            return []
+        return sorted(
+            name[:-3] for name in os.listdir(self.shards_dir)
+            if name.endswith('.db') and TENANT_RE.match(name[:-3])
+        )
+
+    def ensure_shard(self, tenant):
+        """Создаёт файл шарда со схемой, если его ещё нет"""
+        os.makedirs(self.shards_dir, exist_ok=True)
+        conn = self._connect(self.shard_path(tenant))
+        try:
+            conn.executescript(SHARD_SCHEMA)
+            ensure_sync_schema(conn)
+        finally:
+            conn.close()
+
+    def connect(self, tenant):
+        """Соединение с шардом школы; справочник подключён как ``directory``"""
+        path = self.shard_path(tenant)
+        if not os.path.exists(path):
+            self.ensure_shard(tenant)
+        conn = self._connect(path)
+        conn.execute("ATTACH DATABASE ? AS directory", (self.directory_path,))
+        return conn
+
+    def tenant_for_user(self, user_id):
+        conn = self.directory()
+        try:
+            row = conn.execute(
+                "SELECT tenant FROM user_tenants WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            return row['tenant'] if row else None
+        finally:
+            conn.close()
+
+    def assign_tenant(self, user_id, tenant):
+        """Привязывает пользователя к школе и создаёт её шард"""
+        self.ensure_shard(tenant)
+        conn = self.directory()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO user_tenants (user_id, tenant) VALUES (?, ?)",
+                (user_id, tenant)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def parent_tenants(self, user_id):
+        """Все школы, в которых у родителя есть привязанные дети"""
+        conn = self.directory()
+        try:
+            return [row['tenant'] for row in conn.execute(
+                "SELECT tenant FROM parent_tenants WHERE user_id = ? ORDER BY tenant", (user_id,)
+            )]
+        finally:
+            conn.close()
+
+    def add_parent_tenant(self, user_id, tenant):
+        conn = self.directory()
+        try:
+            conn.execute(
+                "INSERT OR IGNORE INTO parent_tenants (user_id, tenant) VALUES (?, ?)",
+                (user_id, tenant)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def cross_shard_query(self, sql, params=(), paths=None, with_directory=False):
+        """Выполняет запрос во всех шардах через ATTACH и объединяет результат.
+
+        В ``sql`` вместо имени схемы используется ``{shard}``, например
+        ``SELECT COUNT(*) FROM {shard}.students``. Первой колонкой каждой
+        строки результата идёт имя школы. ``paths`` позволяет подставить
+        вместо живых шардов другие файлы (например, снимки для отчётов).
+        С ``with_directory`` подключается и справочник, чтобы запрос мог
+        обращаться к ``users``. Все базы подключаются только для чтения.
+        """
+        rows = []
+        tenants = self.tenants()
+        paths = paths or {}
+        conn = sqlite3.connect(":memory:", uri=True)
+        conn.row_factory = sqlite3.Row
+        try:
+            if with_directory:
+                conn.execute("ATTACH DATABASE ? AS directory", (readonly_uri(self.directory_path),))
+            for start in range(0, len(tenants), MAX_ATTACHED):
+                batch = tenants[start:start + MAX_ATTACHED]
+                aliases = [f"shard_{i}" for i in range(len(batch))]
+                for alias, tenant in zip(aliases, batch):
+                    path = paths.get(tenant) or self.shard_path(tenant)
+                    conn.execute(f"ATTACH DATABASE ? AS {alias}", (readonly_uri(path),))
+                try:
+                    union = " UNION ALL ".join(
+                        f"SELECT ? AS tenant, * FROM ({sql.format(shard=alias)})"
+                        for alias in aliases
+                    )
+                    union_params = []
+                    for tenant in batch:
+                        union_params.append(tenant)
+                        union_params.extend(params)
+                    rows.extend(conn.execute(union, union_params).fetchall())
+                finally:
+                    for alias in aliases:
+                        conn.execute(f"DETACH DATABASE {alias}")
+        finally:
+            conn.close()
+        return rows
+
+    def split_by_teacher(self, source_path=None):
+        """Переносит данные общей базы в шарды учителей.
+
+        Каждый учитель получает свой шард, даже если у него ещё нет
+        учеников, иначе его новые записи попадали бы в справочник. Строки
+        учеников, уроков, наград и связей с родителями копируются в шард и
+        удаляются из исходной базы в одной транзакции; ученики без учителя
+        остаются на месте. Идентификаторы сохраняются, поэтому ссылки между
+        таблицами не ломаются. Строка, чей id в шарде уже занят другой
+        записью, остаётся в источнике, так что повторный запуск безопасен.
+        Возвращает словарь ``{tenant: число учеников}``.
+        """
+        source_path = source_path or self.directory_path
+        self.init_directory()
+
+        directory = self.directory()
+        try:
+            teacher_ids = {row[0] for row in directory.execute(
+                "SELECT id FROM users WHERE is_teacher = 1"
+            )}
+        finally:
+            directory.close()
+        src = self._connect(source_path)
+        try:
+            teacher_ids.update(row[0] for row in src.execute(
+                "SELECT DISTINCT teacher_id FROM students WHERE teacher_id IS NOT NULL"
+            ))
+        finally:
+            src.close()
+
+        result = {}
+        for teacher_id in sorted(teacher_ids):
+            tenant = teacher_tenant(teacher_id)
+            self.ensure_shard(tenant)
+            conn = self._connect(self.shard_path(tenant))
+            try:
+                conn.execute("ATTACH DATABASE ? AS src", (source_path,))
+                owned = "SELECT id FROM src.students WHERE teacher_id = ?"
+                with conn:
+                    conn.execute("""
+                        INSERT OR IGNORE INTO students
+                        SELECT id, name, level, start_date, goal, teacher_id
+                        FROM src.students WHERE teacher_id = ?
+                    """, (teacher_id,))
+                    conn.execute(f"""
+                        INSERT OR IGNORE INTO lessons
+                            (id, student_id, date, topic, understanding, participation, homework)
+                        SELECT id, student_id, date, topic, understanding, participation, homework
+                        FROM src.lessons WHERE student_id IN ({owned})
+                    """, (teacher_id,))
+                    for table in ('monthly_awards', 'parents'):
+                        conn.execute(f"""
+                            INSERT OR IGNORE INTO {table}
+                            SELECT * FROM src.{table} WHERE student_id IN ({owned})
+                        """, (teacher_id,))
+                    # Из источника удаляем только то, что теперь лежит в шарде. Строка
+                    # с занятым в шарде id, но другим содержимым остаётся на месте
+                    for table, key in MOVE_KEYS:
+                        conn.execute(f"""
+                            DELETE FROM src.{table}
+                            WHERE student_id IN ({owned})
+                              AND ({key}) IN (SELECT {key} FROM main.{table})
+                        """, (teacher_id,))
+                    conn.execute("""
+                        DELETE FROM src.students
+                        WHERE teacher_id = ?
+                          AND (id, name) IN (SELECT id, name FROM main.students)
+                    """, (teacher_id,))
+                result[tenant] = conn.execute("SELECT COUNT(*) FROM students").fetchone()[0]
+                parent_ids = [row[0] for row in conn.execute("SELECT DISTINCT user_id FROM parents")]
+                conn.execute("DETACH DATABASE src")
+            finally:
+                conn.close()
+
+            self.assign_tenant(teacher_id, tenant)
+            for parent_id in parent_ids:
+                self.add_parent_tenant(parent_id, tenant)
+
+        return result
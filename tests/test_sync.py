@@ -0,0 +1,112 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sync
+from tenancy import SHARD_SCHEMA
+
+TEACHER, OTHER_TEACHER = 1, 2
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(SHARD_SCHEMA)
+    sync.ensure_sync_schema(conn)
+    conn.execute("INSERT INTO students (id, name, teacher_id) VALUES (1, 'Анна', ?)", (TEACHER,))
+    conn.execute("INSERT INTO students (id, name, teacher_id) VALUES (2, 'Олег', ?)", (OTHER_TEACHER,))
+    conn.executemany(
+        "INSERT INTO lessons (id, student_id, date, topic, updated_at) VALUES (?, ?, '2024-09-01', 'Урок', 1000)",
+        [(1, 1), (2, 1), (3, 2)]
+    )
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def edit(edit_id, value, base_version=0, ts=2000, seq=1, lesson_id=1, field='understanding'):
+    return {'id': edit_id, 'seq': seq, 'lesson_id': lesson_id, 'field': field,
+            'value': value, 'base_version': base_version, 'ts': ts}
+
+
+def lesson(conn, lesson_id):
+    return conn.execute(
+        "SELECT understanding, version FROM lessons WHERE id = ?", (lesson_id,)
+    ).fetchone()
+
+
+def test_edit_on_current_version_is_applied(conn):
+    applied, conflicts, token, changes = sync.apply_batch(conn, TEACHER, 1, [edit('a', 3)], 0)
+    assert (applied, conflicts) == (['a'], [])
+    assert lesson(conn, 1) == (3, 1)
+    assert token == 1
+    assert changes == [(1, 3, 0, 0, 1)]
+
+
+def test_stale_version_newer_edit_wins(conn):
+    sync.apply_batch(conn, TEACHER, 1, [edit('a', 3, ts=5000)], 0)
+    # Клиент видел версию 0, но его правка сделана позже последней записи
+    applied, conflicts, _, _ = sync.apply_batch(conn, TEACHER, 1, [edit('b', 1, ts=6000)], 0)
+    assert (applied, conflicts) == (['b'], [])
+    assert lesson(conn, 1) == (1, 2)
+
+
+def test_stale_version_older_edit_conflicts(conn):
+    sync.apply_batch(conn, TEACHER, 1, [edit('a', 3, ts=5000)], 0)
+    applied, conflicts, token, changes = sync.apply_batch(
+        conn, TEACHER, 1, [edit('b', 1, ts=4000)], 1)
+    assert (applied, conflicts) == ([], ['b'])
+    assert lesson(conn, 1) == (3, 1)
+    # Актуальное состояние урока возвращается, хотя он не менялся после токена
+    assert changes == [(1, 3, 0, 0, 1)]
+
+
+def test_retry_is_idempotent(conn):
+    first = sync.apply_batch(conn, TEACHER, 1, [edit('a', 3)], 0)
+    second = sync.apply_batch(conn, TEACHER, 1, [edit('a', 3)], 0)
+    assert first[0] == second[0] == ['a']
+    assert lesson(conn, 1) == (3, 1)
+
+
+def test_retry_of_conflict_stays_conflict(conn):
+    sync.apply_batch(conn, TEACHER, 1, [edit('a', 3, ts=5000)], 0)
+    sync.apply_batch(conn, TEACHER, 1, [edit('b', 1, ts=4000)], 0)
+    applied, conflicts, _, _ = sync.apply_batch(conn, TEACHER, 1, [edit('b', 1, ts=4000)], 0)
+    assert (applied, conflicts) == ([], ['b'])
+
+
+def test_edits_applied_in_client_order(conn):
+    edits = [edit('z', 1, seq=1), edit('a', 5, seq=2)]
+    applied, _, _, _ = sync.apply_batch(conn, TEACHER, 1, list(reversed(edits)), 0)
+    assert applied == ['z', 'a']
+    assert lesson(conn, 1) == (5, 2)
+
+
+def test_other_teachers_lessons_are_not_touched_or_returned(conn):
+    applied, conflicts, _, changes = sync.apply_batch(
+        conn, OTHER_TEACHER, 1, [edit('a', 3)], 0)
+    assert (applied, conflicts) == ([], ['a'])
+    assert changes == []
+    assert lesson(conn, 1) == (0, 0)
+
+
+def test_invalid_value_conflicts(conn):
+    applied, conflicts, _, _ = sync.apply_batch(conn, TEACHER, 1, [edit('a', 9)], 0)
+    assert (applied, conflicts) == ([], ['a'])
+
+
+def test_non_object_edit_is_rejected(conn):
+    with pytest.raises(ValueError):
+        sync.apply_batch(conn, TEACHER, 1, ['a'], 0)
+
+
+def test_old_edit_ids_are_pruned(conn):
+    conn.execute("INSERT INTO sync_edits (edit_id, applied, seen_at) VALUES ('old', 1, 0)")
+    conn.commit()
+    sync.apply_batch(conn, TEACHER, 1, [edit('a', 3)], 0)
+    ids = {row[0] for row in conn.execute("SELECT edit_id FROM sync_edits")}
+    assert ids == {'a'}